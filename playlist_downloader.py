@@ -6,8 +6,176 @@ import random
 import time
 from pathlib import Path
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
+import atexit
+import functools
+import threading
+import sqlite3
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# Shared session so every SoundCloud page fetch reuses pooled keep-alive connections
+_SC_SESSION = requests.Session()
+_SC_SESSION.headers.update(HEADERS)
+_SC_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=Retry(total=3, backoff_factor=1)),
+)
+atexit.register(_SC_SESSION.close)
+
+# External-link page scrapes are independent per track, so they run in a small pool,
+# one batch of tracks at a time
+_SCRAPE_WORKERS = 4
+_BATCH_SIZE = 8
+
+# purchase_url inside the hydration JSON, matched on the raw response bytes
+_HYDRATION_MARKER = b'window.__sc_hydration'
+_PURCHASE_RE = re.compile(rb'"purchase_url"\s*:\s*"([^"]+)"')
+
+
+def _batched(iterable, n):
+    # itertools.batched is Python 3.12+
+    it = iter(iterable)
+    while batch := tuple(islice(it, n)):
+        yield batch
+
+
+class RateLimiter:
+    """
+    Token bucket pacing SoundCloud work: one token per track that needs yt-dlp.
+    
+    Allows short bursts after cheap steps while keeping the average rate at
+    rate_per_sec. backoff() adds a long randomized pause after a 429 or a failed
+    yt-dlp call.
+    """
+    
+    def __init__(self, rate_per_sec=0.2, burst=3):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate_per_sec)
+                self._last = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate_per_sec)
+            # Sleep outside the lock so backoff() is never stuck behind a waiter
+            time.sleep(wait)
+    
+    def backoff(self, min_sleep=5, max_sleep=20):
+        with self._lock:
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + random.uniform(min_sleep, max_sleep))
+
+
+_SC_LIMITER = RateLimiter()
+
+
+def _is_rate_limited(error):
+    text = str(error)
+    return "429" in text or "Too Many Requests" in text
+
+
+# Cached classifications older than this are re-checked
+_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def _open_cache(cache_db):
+    """
+    Open the SQLite cache of per-track classifications, creating the table if needed.
+    """
+    conn = sqlite3.connect(cache_db)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tracks ("
+        "url TEXT PRIMARY KEY, native INT, external INT, external_url TEXT, ts INT, title TEXT)"
+    )
+    # Caches written before the title column existed
+    if "title" not in {row[1] for row in conn.execute("PRAGMA table_info(tracks)")}:
+        conn.execute("ALTER TABLE tracks ADD COLUMN title TEXT")
+    return conn
+
+
+def _cache_lookup(conn, urls):
+    """
+    Return {url: (native, external, external_url, title)} for fresh cache rows among urls.
+    """
+    urls = list(urls)
+    if not urls:
+        return {}
+    placeholders = ",".join("?" * len(urls))
+    rows = conn.execute(
+        f"SELECT url, native, external, external_url, title FROM tracks WHERE url IN ({placeholders}) AND ts >= ?",
+        (*urls, int(time.time()) - _CACHE_MAX_AGE),
+    )
+    return {
+        url: (bool(native), bool(external), external_url or "", title or "")
+        for url, native, external, external_url, title in rows
+    }
+
+
+def _cache_store(conn, url, native, external, external_url, title):
+    conn.execute(
+        "INSERT OR REPLACE INTO tracks (url, native, external, external_url, ts, title) VALUES (?, ?, ?, ?, ?, ?)",
+        (url, int(native), int(external), external_url, int(time.time()), title),
+    )
+
+
+# Flush the buffered log every N rows so a crash loses at most a few entries
+_LOG_FLUSH_EVERY = 20
+
+# Column order of the download log CSV
+LOG_FIELDS = (
+    "track_title",
+    "track_url",
+    "native_download_available",
+    "external_link_available",
+    "external_link",
+    "ytdlp_downloaded",
+    "ytdlp_error",
+)
+
+
+@functools.lru_cache(maxsize=4096)
+def _fetch_external_link(track_url):
+    """
+    Fetch a SoundCloud track page and return its purchase_url, or None.
+    
+    Cached per URL so duplicate/reposted tracks are only scraped once per run.
+    Errors propagate and are therefore not cached.
+    """
+    # Fetch the SoundCloud page HTML (session carries HEADERS). The body is read in
+    # full so the connection goes back to the session pool instead of being closed.
+    # Scrapes are paced by the per-batch submission in the main loop, not the limiter.
+    response = _SC_SESSION.get(track_url, timeout=10)
+    response.raise_for_status()
+    
+    # SoundCloud embeds track data in window.__sc_hydration; search from there
+    # on the raw bytes instead of building a DOM and decoding the whole page
+    content = response.content
+    start = content.find(_HYDRATION_MARKER)
+    if start != -1:
+        match = _PURCHASE_RE.search(content, start)
+        if match:
+            # Decode unicode escapes if present
+            return match.group(1).decode('unicode_escape')
+    return None
 
 
 def check_soundcloud_external_download(track_url):
@@ -21,34 +189,18 @@ def check_soundcloud_external_download(track_url):
         dict with 'has_external_link' (bool) and 'external_link' (str or None)
     """
     try:
-        # Fetch the SoundCloud page HTML
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        response = requests.get(track_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        # Parse HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Look for the embedded JSON data in script tags
-        # SoundCloud embeds track data in window.__sc_hydration
-        for script in soup.find_all('script'):
-            if script.string and 'window.__sc_hydration' in script.string:
-                # Search for purchase_url in the JSON data
-                match = re.search(r'["\']purchase_url["\']\s*:\s*["\']([^"\']+)', script.string)
-                if match:
-                    external_url = match.group(1)
-                    # Decode unicode escapes if present
-                    external_url = external_url.encode().decode('unicode_escape')
-                    return {
-                        'has_external_link': True,
-                        'external_link': external_url
-                    }
+        external_url = _fetch_external_link(track_url)
+        if external_url:
+            return {
+                'has_external_link': True,
+                'external_link': external_url
+            }
         
         return {'has_external_link': False, 'external_link': None}
         
     except Exception as e:
+        if _is_rate_limited(e):
+            _SC_LIMITER.backoff()
         print(f"Error checking external link: {e}")
         return {'has_external_link': False, 'external_link': None, 'error': str(e)}
 
@@ -58,6 +210,7 @@ def analyze_playlist_download_options(
     token: str,
     output_dir: str = "downloads/playlist",
     log_csv: str = "playlist_download_log.csv",
+    cache_db: str = "sc_cache.db",
 ) -> None:
     """
     Analyze a SoundCloud playlist, log download options per track, and download via yt-dlp when needed.
@@ -66,6 +219,7 @@ def analyze_playlist_download_options(
     - Prefer native SoundCloud download when available (do NOT download via yt-dlp).
     - If native download is not available, download via yt-dlp (even if external link exists).
     - Always log availability and yt-dlp success/failure.
+    - Reuse availability cached in cache_db (up to 30 days old) instead of re-checking it.
     """
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
@@ -73,9 +227,6 @@ def analyze_playlist_download_options(
     log_path = Path(log_csv)
     is_new_log = not log_path.exists()
     
-    def sleep_between_tracks():
-        time.sleep(random.uniform(5, 20))
-    
     # Step 1: get playlist entries with minimal requests (flat extraction)
     ydl_opts_list = {
         "extract_flat": True,
@@ -90,7 +241,7 @@ def analyze_playlist_download_options(
         "no_warnings": False,
     }
     
-    # Step 2: per-track info (rate-limited requests)
+    # Step 2: per-track info (rate-limited requests), skipped for cached tracks
     ydl_opts_info = {
         "format": "original/best",
         "username": "oauth",
@@ -136,135 +287,187 @@ def analyze_playlist_download_options(
         "no_warnings": False,
     }
     
-    with open(log_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=[
-                "track_title",
-                "track_url",
-                "native_download_available",
-                "external_link_available",
-                "external_link",
-                "ytdlp_downloaded",
-                "ytdlp_error",
-            ],
-        )
+    with open(log_path, "a", newline="", encoding="utf-8", buffering=1024 * 1024) as f:
+        # Rows are written as tuples in LOG_FIELDS order
+        writer = csv.writer(f)
         if is_new_log:
-            writer.writeheader()
+            writer.writerow(LOG_FIELDS)
         
-        # Get playlist entries flat to avoid bulk metadata requests
-        entries = []
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts_list) as ydl_list:
-                playlist_info = ydl_list.extract_info(playlist_url, download=False)
-                entries = playlist_info.get("entries", []) if playlist_info else []
-        except Exception as e:
-            writer.writerow({
-                "track_title": "",
-                "track_url": playlist_url,
-                "native_download_available": False,
-                "external_link_available": False,
-                "external_link": "",
-                "ytdlp_downloaded": False,
-                "ytdlp_error": f"playlist_error: {e}",
-            })
-            return
+        rows_written = 0
         
-        with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
-            for entry in entries:
-                try:
-                    if not entry:
-                        continue
-                    track_url = entry.get("url") or entry.get("webpage_url")
-                    if not track_url:
-                        continue
-                    
-                    # Fetch full track info (rate-limited per request)
-                    try:
-                        info = ydl.extract_info(track_url, download=False)
-                    except Exception as e:
-                        writer.writerow({
-                            "track_title": entry.get("title", ""),
-                            "track_url": track_url,
-                            "native_download_available": False,
-                            "external_link_available": False,
-                            "external_link": "",
-                            "ytdlp_downloaded": False,
-                            "ytdlp_error": f"info_error: {e}",
-                        })
-                        sleep_between_tracks()
-                        continue
-                    
-                    if not info:
-                        writer.writerow({
-                            "track_title": entry.get("title", ""),
-                            "track_url": track_url,
-                            "native_download_available": False,
-                            "external_link_available": False,
-                            "external_link": "",
-                            "ytdlp_downloaded": False,
-                            "ytdlp_error": "info_error: unavailable (None)",
-                        })
-                        sleep_between_tracks()
-                        continue
-                    
-                    title = info.get("title", "")
-                    native_available = bool(info.get("download_url"))
-                    
-                    external_link = ""
-                    external_available = False
-                    try:
-                        ext_result = check_soundcloud_external_download(track_url)
-                        external_available = bool(ext_result.get("has_external_link"))
-                        external_link = ext_result.get("external_link") or ""
-                    except Exception:
-                        pass
-                    
-                    # If native download is available, prefer it (no yt-dlp download)
-                    if native_available:
-                        writer.writerow({
-                            "track_title": title,
-                            "track_url": track_url,
-                            "native_download_available": True,
-                            "external_link_available": external_available,
-                            "external_link": external_link,
-                            "ytdlp_downloaded": False,
-                            "ytdlp_error": "",
-                        })
-                        sleep_between_tracks()
+        def log_row(row):
+            nonlocal rows_written
+            writer.writerow(row)
+            rows_written += 1
+            if rows_written % _LOG_FLUSH_EVERY == 0:
+                f.flush()
+        
+        with closing(_open_cache(cache_db)) as cache, \
+                ThreadPoolExecutor(max_workers=_SCRAPE_WORKERS) as scrape_pool, \
+                yt_dlp.YoutubeDL(ydl_opts_info) as ydl, \
+                yt_dlp.YoutubeDL(ydl_opts_download) as ydl_dl:
+            # Get playlist entries flat so every track URL is known (and logged) up front
+            entries = []
+            try:
+                _SC_LIMITER.acquire()
+                with yt_dlp.YoutubeDL(ydl_opts_list) as ydl_list:
+                    playlist_info = ydl_list.extract_info(playlist_url, download=False)
+                entries = list(playlist_info.get("entries") or []) if playlist_info else []
+            except Exception as e:
+                log_row((
+                    "",
+                    playlist_url,
+                    False,
+                    False,
+                    "",
+                    False,
+                    f"playlist_error: {e}",
+                ))
+                return
+            
+            # Work through the playlist in batches: each batch's HTML scrapes run concurrently
+            # while the yt-dlp calls below stay serial and rate-limited, so page fetches never
+            # run far ahead of the downloads. Tracks already classified in the cache don't
+            # need a scrape.
+            for batch in _batched(entries, _BATCH_SIZE):
+                cached = _cache_lookup(
+                    cache, {(e.get("url") or e.get("webpage_url")) for e in batch if e} - {None}
+                )
+                external_futures = {}
+                for entry in batch:
+                    track_url = (entry.get("url") or entry.get("webpage_url")) if entry else None
+                    if track_url in cached:
                         continue
-                    
-                    # Otherwise download with yt-dlp (even if external link exists)
-                    ytdlp_ok = False
-                    ytdlp_err = ""
+                    if track_url and track_url not in external_futures:
+                        external_futures[track_url] = scrape_pool.submit(check_soundcloud_external_download, track_url)
+                
+                for entry in batch:
                     try:
-                        with yt_dlp.YoutubeDL(ydl_opts_download) as ydl_dl:
-                            ydl_dl.download([track_url])
-                        ytdlp_ok = True
+                        if not entry:
+                            # yt-dlp keeps tracks it could not list as None entries
+                            log_row((
+                                "",
+                                "",
+                                False,
+                                False,
+                                "",
+                                False,
+                                "info_error: unavailable (None)",
+                            ))
+                            continue
+                        track_url = entry.get("url") or entry.get("webpage_url")
+                        if not track_url:
+                            continue
+                        
+                        # One limiter token per track that still needs yt-dlp (info and/or download);
+                        # yt-dlp's own sleep_interval_requests paces the requests inside each call
+                        if track_url not in cached or not cached[track_url][0]:
+                            _SC_LIMITER.acquire()
+                        
+                        # Fetch full track info unless the cache has it
+                        try:
+                            info = entry
+                            if track_url not in cached:
+                                info = ydl.extract_info(track_url, download=False)
+                        except Exception as e:
+                            log_row((
+                                entry.get("title", ""),
+                                track_url,
+                                False,
+                                False,
+                                "",
+                                False,
+                                f"info_error: {e}",
+                            ))
+                            continue
+                        
+                        if not info:
+                            # With ignoreerrors yt-dlp reports failures (429s included) by
+                            # returning None rather than raising, so back off on any failure
+                            _SC_LIMITER.backoff()
+                            log_row((
+                                entry.get("title", ""),
+                                track_url,
+                                False,
+                                False,
+                                "",
+                                False,
+                                "info_error: unavailable (None)",
+                            ))
+                            continue
+                        
+                        title = info.get("title", "")
+                        if track_url in cached:
+                            # Flat listing entries carry no title, so it comes from the cache too
+                            native_available, external_available, external_link, cached_title = cached[track_url]
+                            # Rows cached before titles were stored fall back to the URL slug
+                            title = cached_title or title or track_url.rstrip("/").rsplit("/", 1)[-1]
+                        else:
+                            native_available = bool(info.get("download_url"))
+                            
+                            external_link = ""
+                            external_available = False
+                            try:
+                                ext_result = external_futures[track_url].result()
+                                external_available = bool(ext_result.get("has_external_link"))
+                                external_link = ext_result.get("external_link") or ""
+                                classified = "error" not in ext_result
+                            except Exception:
+                                classified = False
+                            
+                            # Only cache complete classifications so failed scrapes are retried next run
+                            if classified:
+                                _cache_store(cache, track_url, native_available, external_available, external_link, title)
+                        
+                        # If native download is available, prefer it (no yt-dlp download)
+                        if native_available:
+                            log_row((
+                                title,
+                                track_url,
+                                True,
+                                external_available,
+                                external_link,
+                                False,
+                                "",
+                            ))
+                            continue
+                        
+                        # Otherwise download with yt-dlp (even if external link exists)
+                        ytdlp_ok = False
+                        ytdlp_err = ""
+                        try:
+                            # With ignoreerrors failures show up in the return code, not as exceptions.
+                            # The shared instance never resets it after an error, so clear it per track.
+                            ydl_dl._download_retcode = 0
+                            retcode = ydl_dl.download([track_url])
+                            ytdlp_ok = retcode == 0
+                            if not ytdlp_ok:
+                                ytdlp_err = f"download_error: yt-dlp returned {retcode}"
+                                _SC_LIMITER.backoff()
+                        except Exception as e:
+                            ytdlp_err = str(e)
+                        
+                        log_row((
+                            title,
+                            track_url,
+                            False,
+                            external_available,
+                            external_link,
+                            ytdlp_ok,
+                            ytdlp_err,
+                        ))
                     except Exception as e:
-                        ytdlp_err = str(e)
-                    
-                    writer.writerow({
-                        "track_title": title,
-                        "track_url": track_url,
-                        "native_download_available": False,
-                        "external_link_available": external_available,
-                        "external_link": external_link,
-                        "ytdlp_downloaded": ytdlp_ok,
-                        "ytdlp_error": ytdlp_err,
-                    })
-                    sleep_between_tracks()
-                except Exception as e:
-                    writer.writerow({
-                        "track_title": entry.get("title", "") if entry else "",
-                        "track_url": (entry.get("url") or entry.get("webpage_url")) if entry else "",
-                        "native_download_available": False,
-                        "external_link_available": False,
-                        "external_link": "",
-                        "ytdlp_downloaded": False,
-                        "ytdlp_error": f"unexpected_error: {e}",
-                    })
-                    sleep_between_tracks()
+                        log_row((
+                            entry.get("title", "") if entry else "",
+                            (entry.get("url") or entry.get("webpage_url")) if entry else "",
+                            False,
+                            False,
+                            "",
+                            False,
+                            f"unexpected_error: {e}",
+                        ))
+                
+                cache.commit()
 
 if __name__ == "__main__":
 
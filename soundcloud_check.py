@@ -1,11 +1,18 @@
 from __future__ import annotations
 
 import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from dataclasses import dataclass
+import importlib.util
+import os
 from pathlib import Path
 import re
-from typing import Iterable
+from typing import TYPE_CHECKING, Iterable, Iterator
+
+if TYPE_CHECKING:
+	from mutagen.id3 import ID3  # type: ignore
 
 
 @dataclass(frozen=True)
@@ -28,6 +35,7 @@ class Track:
 
 
 _SC_URL_RE = re.compile(r"https?://(?:on\.)?soundcloud\.com/[^\s\]\)\"\'<>]+", re.IGNORECASE)
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]+")
 
 def _track_key(artist: str, title: str) -> tuple[str, str] | None:
 	artist = (artist or "").strip()
@@ -45,14 +53,14 @@ def _tokenize(text: str) -> set[str]:
 
 	This is intentionally simple: split on non-alphanumerics and compare case-insensitively.
 	"""
-	t = _casefold(text)
-	if not t:
-		return set()
-	for ch in t:
-		# Fast path: avoid regex; normalize separators to spaces.
-		if not ("a" <= ch <= "z" or "0" <= ch <= "9" or ch.isspace()):
-			t = t.replace(ch, " ")
-	return {p for p in t.split() if p}
+	return _tokenize_many((text,))[0]
+
+
+def _tokenize_many(texts: Iterable[str]) -> list[set[str]]:
+	"""Tokenize many strings at once; the single normalization used by _tokenize."""
+	# Single pass per string: normalize every run of separators to a space.
+	sub = _NON_ALNUM_RE.sub
+	return [set(sub(" ", _casefold(text)).split()) for text in texts]
 
 
 def _normalize_url(url: str | None) -> str | None:
@@ -67,11 +75,28 @@ def _normalize_url(url: str | None) -> str | None:
 	return u.casefold()
 
 
-def _extract_soundcloud_url_from_comment(mp3_path: Path) -> str | None:
+def _first_shared_index(
+	a_postings: list[set[int]], b_postings: list[set[int]]
+) -> int | None:
+	"""Return some index in the intersection of union(a) and union(b), or None.
+
+	Neither union is built: walk the side with fewer total entries (rarest
+	postings first) and probe the other side's sets directly. Which shared
+	index is returned depends on that walk order.
+	"""
+	if sum(map(len, a_postings)) > sum(map(len, b_postings)):
+		a_postings, b_postings = b_postings, a_postings
+	for posting in sorted(a_postings, key=len):
+		for idx in posting:
+			if any(idx in other for other in b_postings):
+				return idx
+	return None
+
+
+def _extract_soundcloud_url_from_comment(mp3_path: str | Path) -> str | None:
 	"""Extract a SoundCloud URL from ID3 comment (COMM) frames, if present."""
 	try:
 		from mutagen.id3 import ID3  # type: ignore
-		from mutagen.id3 import COMM  # type: ignore
 	except ImportError:
 		return None
 
@@ -79,6 +104,15 @@ def _extract_soundcloud_url_from_comment(mp3_path: Path) -> str | None:
 		tags = ID3(str(mp3_path))
 	except Exception:
 		return None
+	return _comment_url_from_tags(tags)
+
+
+def _comment_url_from_tags(tags: ID3) -> str | None:
+	"""Like _extract_soundcloud_url_from_comment, for an already-parsed ID3 tag."""
+	try:
+		from mutagen.id3 import COMM  # type: ignore
+	except ImportError:
+		return None
 
 	comments: list[str] = []
 	for frame in tags.values():
@@ -156,49 +190,97 @@ def export_playlist_to_csv(playlist_url: str, csv_path: str | Path) -> list[Trac
 	return tracks
 
 
-def iter_local_mp3_tracks(folder: str | Path) -> Iterable[Track]:
-	folder_path = Path(folder)
-	if not folder_path.exists():
-		raise FileNotFoundError(f"Folder not found: {folder_path}")
+def _frame_text(tags: ID3, frame_id: str) -> str:
+	frame = tags.get(frame_id)
+	values = getattr(frame, "text", None) or [""]
+	return str(values[0]).strip()
+
+
+def _iter_mp3_paths(root: str | Path) -> Iterator[str]:
+	"""Yield paths of all .mp3 files under root.
+
+	Walks with os.scandir so directory entries reuse their cached type info
+	instead of building a Path per file; unreadable directories are skipped.
+	"""
+	stack = [str(root)]
+	while stack:
+		try:
+			with os.scandir(stack.pop()) as it:
+				for entry in it:
+					try:
+						if entry.is_dir(follow_symlinks=False):
+							stack.append(entry.path)
+						elif entry.name.lower().endswith(".mp3") and entry.is_file():
+							yield entry.path
+					except OSError:
+						continue
+		except OSError:
+			continue
 
-	try:
-		from mutagen.easyid3 import EasyID3  # type: ignore
-		from mutagen.mp3 import MP3  # type: ignore
-	except ImportError:
-		raise RuntimeError(
-			"mutagen is required to read local MP3 ID3 tags. Install with: pip install -U mutagen"
-		)
 
-	for path in folder_path.rglob("*.mp3"):
-		artist = ""
-		title = ""
-		duration: float | None = None
-		comment_url: str | None = None
+def _read_mp3(path: str | Path) -> Track:
+	"""Read artist/title, duration and comment URL from a single MP3.
+
+	The file is parsed once; the ID3 tag loaded by MP3 also serves the
+	artist/title and comment lookups.
+	"""
+	from mutagen.id3 import ID3  # type: ignore
+	from mutagen.mp3 import MP3  # type: ignore
+
+	artist = ""
+	title = ""
+	duration: float | None = None
+	comment_url: str | None = None
 
+	tags = None
+	try:
+		audio = MP3(str(path))
+		duration = float(audio.info.length) if getattr(audio, "info", None) else None
+		tags = audio.tags
+	except Exception:
+		# Broken audio frames can still carry a readable ID3 tag.
+		duration = None
 		try:
-			tags = EasyID3(str(path))
-			artist = (tags.get("artist") or [""])[0].strip()
-			title = (tags.get("title") or [""])[0].strip()
+			tags = ID3(str(path))
 		except Exception:
-			artist = ""
-			title = ""
+			tags = None
 
+	if tags is not None:
 		try:
-			audio = MP3(str(path))
-			duration = float(audio.info.length) if getattr(audio, "info", None) else None
+			artist = _frame_text(tags, "TPE1")
+			title = _frame_text(tags, "TIT2")
 		except Exception:
-			duration = None
+			artist = ""
+			title = ""
+		comment_url = _comment_url_from_tags(tags)
+
+	return Track(
+		artist=artist,
+		title=title,
+		url=str(path),
+		duration=duration,
+		comment_url=comment_url,
+	)
 
-		comment_url = _extract_soundcloud_url_from_comment(path)
 
-		yield Track(
-			artist=artist,
-			title=title,
-			url=str(path),
-			duration=duration,
-			comment_url=comment_url,
+def iter_local_mp3_tracks(folder: str | Path) -> Iterable[Track]:
+	folder_path = Path(folder)
+	if not folder_path.exists():
+		raise FileNotFoundError(f"Folder not found: {folder_path}")
+
+	# _read_mp3 does its own imports; only check availability here.
+	if importlib.util.find_spec("mutagen") is None:
+		raise RuntimeError(
+			"mutagen is required to read local MP3 ID3 tags. Install with: pip install -U mutagen"
 		)
 
+	# Tag parsing is small blocking reads per file; overlap them across threads.
+	paths = list(_iter_mp3_paths(folder_path))
+	max_workers = min(32, (os.cpu_count() or 1) * 4)
+	with ThreadPoolExecutor(max_workers=max_workers) as ex:
+		for track in ex.map(_read_mp3, paths):
+			yield track
+
 
 def export_local_to_csv(local_folder: str | Path, csv_path: str | Path) -> list[Track]:
 	local_tracks = list(iter_local_mp3_tracks(local_folder))
@@ -227,31 +309,34 @@ def sync(
 	playlist_tracks = export_playlist_to_csv(playlist_url, playlist_csv_path)
 	local_tracks = export_local_to_csv(local_folder, local_csv_path)
 
-	local_artist_index: dict[str, set[int]] = {}
-	local_title_index: dict[str, set[int]] = {}
-	local_sc_url_index: dict[str, set[int]] = {}
+	local_artist_index: defaultdict[str, set[int]] = defaultdict(set)
+	local_title_index: defaultdict[str, set[int]] = defaultdict(set)
+	local_sc_url_index: dict[str, int] = {}
 	skipped_local = 0
-	for idx, t in enumerate(local_tracks):
-		artist_tokens = _tokenize(t.artist)
-		title_tokens = _tokenize(t.title)
+	local_artist_tokens = _tokenize_many(t.artist for t in local_tracks)
+	local_title_tokens = _tokenize_many(t.title for t in local_tracks)
+	for idx, (t, artist_tokens, title_tokens) in enumerate(
+		zip(local_tracks, local_artist_tokens, local_title_tokens)
+	):
 		if not artist_tokens or not title_tokens:
 			skipped_local += 1
 			continue
 		for tok in artist_tokens:
-			local_artist_index.setdefault(tok, set()).add(idx)
+			local_artist_index[tok].add(idx)
 		for tok in title_tokens:
-			local_title_index.setdefault(tok, set()).add(idx)
+			local_title_index[tok].add(idx)
 		sc_url = _normalize_url(t.comment_url)
 		if sc_url:
-			local_sc_url_index.setdefault(sc_url, set()).add(idx)
+			# Only one local file is ever reported per URL; keep the first.
+			local_sc_url_index.setdefault(sc_url, idx)
 
 	missing: list[Track] = []
 	joined_rows: list[tuple[str, Track, Track | None]] = []
 	for t in playlist_tracks:
 		# 1) Fallback match: SoundCloud URL stored in local MP3 comment.
 		playlist_sc_url = _normalize_url(t.url)
-		if playlist_sc_url and playlist_sc_url in local_sc_url_index:
-			match_idx = next(iter(local_sc_url_index[playlist_sc_url]))
+		match_idx = local_sc_url_index.get(playlist_sc_url) if playlist_sc_url else None
+		if match_idx is not None:
 			joined_rows.append(("url", t, local_tracks[match_idx]))
 			continue
 
@@ -263,17 +348,11 @@ def sync(
 			missing.append(t)
 			continue
 
-		artist_candidates: set[int] = set()
-		for tok in artist_tokens:
-			artist_candidates |= local_artist_index.get(tok, set())
-
-		title_candidates: set[int] = set()
-		for tok in title_tokens:
-			title_candidates |= local_title_index.get(tok, set())
+		artist_postings = [local_artist_index[tok] for tok in artist_tokens if tok in local_artist_index]
+		title_postings = [local_title_index[tok] for tok in title_tokens if tok in local_title_index]
 
-		intersection = artist_candidates & title_candidates
-		if intersection:
-			match_idx = next(iter(intersection))
+		match_idx = _first_shared_index(artist_postings, title_postings)
+		if match_idx is not None:
 			joined_rows.append(("tokens", t, local_tracks[match_idx]))
 		else:
 			joined_rows.append(("missing", t, None))